@@ -12,225 +12,491 @@ Course: CST8916
 
 import asyncio
 import json
-import random
 import os
-from datetime import datetime
+import sys
+import time
+import numpy as np
+from numba import njit
 from azure.iot.device.aio import IoTHubDeviceClient
 from azure.iot.device import Message
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-# This keeps secrets out of code!
-load_dotenv()
-
 # Configuration for three sensor locations
 # Each sensor has unique device ID and connection string
-SENSORS = {
-    "dows-lake": {
-        "device_id": "dows-lake-sensor",
-        "connection_string": os.getenv("DOWS_LAKE_CONNECTION_STRING"),
-        "location": "Dow's Lake"
-    },
-    "fifth-avenue": {
-        "device_id": "fifth-avenue-sensor",
-        "connection_string": os.getenv("FIFTH_AVENUE_CONNECTION_STRING"),
-        "location": "Fifth Avenue"
-    },
-    "nac": {
-        "device_id": "nac-sensor",
-        "connection_string": os.getenv("NAC_CONNECTION_STRING"),
-        "location": "NAC"
-    }
-}
+# (location key, connection string environment variable, display name)
+# Device IDs are derived from the key, e.g. 'dows-lake' → 'dows-lake-sensor'
+SENSOR_SPECS = (
+    ("dows-lake", "DOWS_LAKE_CONNECTION_STRING", "Dow's Lake"),
+    ("fifth-avenue", "FIFTH_AVENUE_CONNECTION_STRING", "Fifth Avenue"),
+    ("nac", "NAC_CONNECTION_STRING", "NAC"),
+)
+
+# Reconnection settings
+# After a failed send, reconnect with exponential backoff (1s, 2s)
+# so a dropped connection is restored before the next 10 second reading
+RECONNECT_ATTEMPTS = 3
+RECONNECT_BASE_DELAY = 1    # seconds
+
+# Safety status for every combination of the four threshold checks,
+# indexed by a 4-bit code built from a reading:
+#   8 = ice >= 30cm, 4 = ice >= 25cm, 2 = surface <= -2°C, 1 = surface <= 0°C
+# SAFE needs 8 and 2, CAUTION needs 4 and 1, anything else is UNSAFE
+# This matches the Stream Analytics logic
+STATUS_TABLE = np.array([
+    "🟢 SAFE" if (code & 0b1010) == 0b1010
+    else "🟡 CAUTION" if (code & 0b0101) == 0b0101
+    else "🔴 UNSAFE"
+    for code in range(16)
+])
+
+# Random walk configuration
+# Every state vector is ordered as:
+# [ice_thickness, surface_temp, snow_accumulation, external_temp]
+# Starting values: ice 28-35cm (good), surface -10 to -1°C (below freezing),
+# snow 0-5cm (light to moderate), external -15 to -2°C (winter conditions)
+INITIAL_LOWS = np.array([28.0, -10.0, 0.0, -15.0])
+INITIAL_HIGHS = np.array([35.0, -1.0, 5.0, -2.0])
+DELTA_LOWS = np.array([-0.5, -0.5, -0.1, -0.3])    # Largest decrease per reading
+DELTA_HIGHS = np.array([0.3, 0.5, 0.3, 0.3])       # Largest increase per reading
+LOW_BOUNDS = np.array([20.0, -15.0, 0.0, -20.0])   # Realistic minimums
+HIGH_BOUNDS = np.array([40.0, 2.0, 10.0, 5.0])     # Realistic maximums
+
+
+@njit(cache=True, fastmath=True)
+def _advance(states, deltas, low, high):
+    """
+    Apply one random walk step to every sensor's state in place
+    
+    Compiled to native code by Numba so the per-reading arithmetic
+    doesn't go through the Python interpreter.
+    Equivalent to np.clip(states + deltas, low, high, out=states).
+    
+    Args:
+        states (np.ndarray): Current values, one row per sensor (updated in place)
+        deltas (np.ndarray): Change to apply to each value, same shape as states
+        low (np.ndarray): Lower bound for each of the four values
+        high (np.ndarray): Upper bound for each of the four values
+    
+    Returns:
+        np.ndarray: The updated states
+    """
+    # min/max instead of if/elif, so the clamp compiles to branchless
+    # min/max instructions rather than compare-and-jump
+    for n in range(states.shape[0]):
+        for k in range(4):
+            states[n, k] = min(max(states[n, k] + deltas[n, k], low[k]), high[k])
+    return states
+
+
+@njit(cache=True, fastmath=True)
+def _walk(initial, deltas, low, high):
+    """
+    Pre-compute the random walk of every sensor for a whole run
+    
+    Equivalent to a cumulative sum of the deltas, except that values are
+    kept within bounds at every step, so a value that hits a bound moves
+    away from it as soon as the deltas turn around.
+    
+    Args:
+        initial (np.ndarray): Starting values, one row per sensor
+        deltas (np.ndarray): Pre-sampled changes, shape (iterations, sensors, 4)
+        low (np.ndarray): Lower bound for each of the four values
+        high (np.ndarray): Upper bound for each of the four values
+    
+    Returns:
+        np.ndarray: Values after each step, same shape as deltas
+    """
+    trajectory = np.empty_like(deltas)
+    state = initial.copy()
+    for i in range(deltas.shape[0]):
+        trajectory[i] = _advance(state, deltas[i], low, high)
+    return trajectory
+
 
+# Cache for _utc_timestamp: [whole seconds, formatted date/time for that second]
+_timestamp_cache = [None, ""]
 
-class SensorSimulator:
+
+def _utc_timestamp():
     """
-    Simulates a single IoT sensor at a specific location.
+    Get the current UTC time as an ISO 8601 string with milliseconds
+    
+    The date/time part is only reformatted when the whole second changes;
+    otherwise just the milliseconds are appended to the cached string.
+    
+    Returns:
+        str: Timestamp like '2024-12-08T14:30:25.123Z'
+    """
+    now = time.time()
+    seconds = int(now)
+    if seconds != _timestamp_cache[0]:
+        _timestamp_cache[0] = seconds
+        _timestamp_cache[1] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f"{_timestamp_cache[1]}.{int((now - seconds) * 1000):03d}Z"
+
+
+class SensorFarm:
+    """
+    Simulates a group of IoT sensors, one per location.
     
     Generates realistic sensor readings with gradual changes over time
-    using a random walk algorithm.
+    using a random walk algorithm. The state of every sensor lives in a
+    single array (one row per sensor), so each reading updates all
+    sensors at once.
     
     Attributes:
-        location_key (str): Identifier for the location (e.g., 'dows-lake')
-        config (dict): Configuration dictionary with device details
-        location (str): Human-readable location name
-        connection_string (str): Azure IoT Hub connection string
-        client (IoTHubDeviceClient): Azure IoT Hub client
-        ice_thickness (float): Current ice thickness in cm
-        surface_temp (float): Current surface temperature in °C
-        snow_accumulation (float): Current snow depth in cm
-        external_temp (float): Current external temperature in °C
+        device_ids (list): IoT Hub device ID for each sensor
+        locations (list): Human-readable location name for each sensor
+        connection_strings (list): Azure IoT Hub connection string for each sensor
+        clients (list): Azure IoT Hub client (IoTHubDeviceClient) for each sensor
+        states (np.ndarray): Current values, shape (sensors, 4); each row is
+            [ice thickness (cm), surface temp (°C), snow depth (cm), external temp (°C)]
+        rngs (list): Independent PCG64 random number generator for each sensor
+        trajectory (np.ndarray): Every reading of the run rounded to 2 decimal
+            places, shape (iterations, sensors, 4), once plan() has been called
+        messages_sent (list): Number of messages successfully sent so far, per sensor
     """
     
-    def __init__(self, location_key, config):
+    def __init__(self, sensors, seed=None):
         """
-        Initialize sensor simulator with starting values
+        Initialize all sensors with starting values
         
         Args:
-            location_key (str): Key identifier (e.g., 'dows-lake')
-            config (dict): Configuration with device_id, connection_string, location
+            sensors (dict): Configuration with device_id, connection_string and
+                location, keyed by location key (e.g., 'dows-lake')
+            seed (int): Optional seed to make the simulated data reproducible
         """
-        self.location_key = location_key
-        self.config = config
-        self.location = config["location"]
-        self.connection_string = config["connection_string"]
-        self.client = None
+        self.device_ids = [config["device_id"] for config in sensors.values()]
+        self.locations = [config["location"] for config in sensors.values()]
+        self.connection_strings = [config["connection_string"] for config in sensors.values()]
+        self.clients = [None] * len(sensors)
+        self.trajectory = None
+        self.messages_sent = [0] * len(sensors)
+        self._queues = []
+        self._consumers = []
+        
+        # Pre-build a bytes template for every sensor's JSON payload
+        # deviceId and location are filled in (and JSON-escaped) once here;
+        # each reading only fills in the timestamp and the four measurements
+        self._templates = [
+            (b'{"deviceId":%s,"location":%s' % (
+                json.dumps(device_id).encode(), json.dumps(location).encode()
+            )).replace(b"%", b"%%")
+            + b',"timestamp":"%s","iceThickness":%.2f,"surfaceTemp":%.2f,'
+              b'"snowAccumulation":%.2f,"externalTemp":%.2f}'
+            for device_id, location in zip(self.device_ids, self.locations)
+        ]
+        
+        # Reusable IoT Hub message per sensor; only its body changes between readings
+        # Safe because each sensor's sender task sends one message at a time
+        self._messages = []
+        for _ in sensors:
+            message = Message(b"")
+            message.content_encoding = "utf-8"
+            message.content_type = "application/json"
+            self._messages.append(message)
+        
+        # One PCG64 generator per sensor, each with its own independent stream
+        # (PCG64 is faster than the Mersenne Twister behind the random module)
+        self.rngs = [
+            np.random.Generator(np.random.PCG64(child))
+            for child in np.random.SeedSequence(seed).spawn(len(sensors))
+        ]
         
         # Initialize sensor state with realistic baseline values
         # Each location starts with slightly different conditions
-        self.ice_thickness = random.uniform(28, 35)       # cm - typically 28-35cm is good
-        self.surface_temp = random.uniform(-10, -1)       # °C - below freezing
-        self.snow_accumulation = random.uniform(0, 5)     # cm - light to moderate snow
-        self.external_temp = random.uniform(-15, -2)      # °C - winter conditions
+        self.states = np.stack([
+            rng.uniform(INITIAL_LOWS, INITIAL_HIGHS) for rng in self.rngs
+        ])
+        
+        # Warm up the JIT so the first reading isn't slowed by compilation
+        _walk(np.zeros((1, 4)), np.zeros((1, 1, 4)), LOW_BOUNDS, HIGH_BOUNDS)
     
     async def connect(self):
         """
-        Connect to Azure IoT Hub using device connection string
+        Connect every sensor to Azure IoT Hub concurrently
+        
+        Returns:
+            bool: True if all sensors connected successfully, False otherwise
+        """
+        # asyncio.gather runs multiple async functions at once
+        results = await asyncio.gather(
+            *[self._connect(k) for k in range(len(self.clients))]
+        )
+        return all(results)
+    
+    async def _connect(self, k):
+        """
+        Connect one sensor to Azure IoT Hub using its device connection string
         
         Uses MQTT protocol for communication (efficient for IoT)
+        over a direct TCP/TLS socket, with a keep-alive well above the
+        10 second send interval so the broker never needs extra pings.
+        The SDK's automatic connect/retry is disabled; dropped
+        connections are restored explicitly in _reconnect()
+        
+        Args:
+            k (int): Index of the sensor
         
         Returns:
             bool: True if connection successful, False otherwise
         """
         try:
             # Create IoT Hub client from connection string
-            self.client = IoTHubDeviceClient.create_from_connection_string(
-                self.connection_string
+            self.clients[k] = IoTHubDeviceClient.create_from_connection_string(
+                self.connection_strings[k],
+                websockets=False,       # Plain MQTT on port 8883, no websocket framing
+                keep_alive=30,          # Seconds of silence allowed before a ping
+                auto_connect=False,     # Never connect implicitly inside send_message
+                connection_retry=False  # Reconnects are handled by _reconnect()
             )
             
             # Establish connection (async operation)
-            await self.client.connect()
+            await self.clients[k].connect()
             
-            print(f"✓ Connected: {self.location} ({self.config['device_id']})")
+            print(f"✓ Connected: {self.locations[k]} ({self.device_ids[k]})")
             return True
             
         except Exception as e:
-            print(f"✗ Connection failed for {self.location}: {e}")
+            print(f"✗ Connection failed for {self.locations[k]}: {e}")
             return False
     
-    def generate_reading(self):
+    def plan(self, iterations):
         """
-        Generate a realistic sensor reading with gradual changes
+        Pre-compute every reading of the run
         
         Uses random walk algorithm:
         - Each value changes by a small random amount
         - Simulates natural environmental changes
         - Values stay within realistic bounds
         
+        Args:
+            iterations (int): Number of readings per sensor
+        """
+        # Pre-sample every random walk step for the whole run,
+        # one NumPy call per sensor from that sensor's generator
+        # Shape: (iterations, sensors, 4) - one row of deltas per sensor per reading
+        deltas = np.stack([
+            rng.uniform(DELTA_LOWS, DELTA_HIGHS, size=(iterations, 4))
+            for rng in self.rngs
+        ], axis=1)
+        
+        # All steps for all sensors are computed at once and kept
+        # within realistic bounds (see _walk)
+        trajectory = _walk(self.states, deltas, LOW_BOUNDS, HIGH_BOUNDS)
+        
+        # Round every reading to 2 decimal places in one vector operation
+        # (after the walk, so rounding never feeds back into later steps)
+        self.trajectory = np.rint(trajectory * 100) / 100
+    
+    def tick(self, i):
+        """
+        Move every sensor to its pre-computed values for reading i
+        
+        Args:
+            i (int): Index of the reading (0-based)
+        
         Returns:
-            dict: Sensor reading with timestamp and measurements
+            np.ndarray: The current states, shape (sensors, 4)
+        """
+        self.states = self.trajectory[i]
+        return self.states
+    
+    def encode(self, states, timestamp):
         """
+        Convert one reading per sensor to a JSON payload
         
-        # Simulate gradual changes using random walk
-        # Ice thickness: slowly changes (melting or freezing)
-        self.ice_thickness += random.uniform(-0.5, 0.3)
-        
-        # Surface temperature: fluctuates with weather
-        self.surface_temp += random.uniform(-0.5, 0.5)
-        
-        # Snow accumulation: mostly increases, rarely decreases
-        self.snow_accumulation += random.uniform(-0.1, 0.3)
-        
-        # External temperature: changes with time of day
-        self.external_temp += random.uniform(-0.3, 0.3)
-        
-        # Keep values within realistic bounds
-        # Ice can't be too thin or too thick
-        self.ice_thickness = max(20, min(40, self.ice_thickness))
-        
-        # Temperature constraints
-        self.surface_temp = max(-15, min(2, self.surface_temp))
-        self.snow_accumulation = max(0, min(10, self.snow_accumulation))
-        self.external_temp = max(-20, min(5, self.external_temp))
-        
-        # Create sensor reading in JSON format
-        # This matches the format Stream Analytics expects
-        reading = {
-            "deviceId": self.config["device_id"],
-            "location": self.location,
-            "timestamp": datetime.utcnow().isoformat() + "Z",  # ISO 8601 format with UTC
-            "iceThickness": round(self.ice_thickness, 2),
-            "surfaceTemp": round(self.surface_temp, 2),
-            "snowAccumulation": round(self.snow_accumulation, 2),
-            "externalTemp": round(self.external_temp, 2)
-        }
+        Runs synchronously, so all of a round's Python work happens
+        before any await and the async code only does network I/O.
+        
+        Args:
+            states (np.ndarray): Sensor values to send, shape (sensors, 4)
+            timestamp (str): ISO 8601 UTC timestamp shared by this round of readings
         
-        return reading
+        Returns:
+            list: JSON payload (bytes) for each sensor
+        """
+        # Encode to JSON in the format Stream Analytics expects
+        # by filling each sensor's template straight from its row of values
+        timestamp = timestamp.encode()  # ISO 8601 format with UTC
+        return [
+            template % (timestamp, *row)
+            for template, row in zip(self._templates, states.tolist())
+        ]
     
-    async def send_reading(self):
+    def start(self):
         """
-        Generate and send a sensor reading to Azure IoT Hub
+        Start one long-lived sender task per sensor
         
-        Process:
-        1. Generate reading
-        2. Convert to JSON
-        3. Create IoT Hub message
-        4. Send via MQTT
-        5. Display status
+        Each task waits on its sensor's queue and sends payloads as
+        they arrive, so no new tasks are created per reading.
+        Must be called from inside the running event loop.
+        """
+        # Each queue holds at most one waiting reading, so a sensor that is
+        # stuck reconnecting never falls more than one reading behind
+        self._queues = [asyncio.Queue(maxsize=1) for _ in self.clients]
+        self._consumers = [
+            asyncio.create_task(self._consume(k)) for k in range(len(self.clients))
+        ]
+    
+    def send_all(self, payloads, lines):
+        """
+        Queue one encoded reading per sensor for sending to Azure IoT Hub
+        
+        Returns immediately; each sensor's sender task (see start())
+        puts the payload in the sensor's cached IoT Hub message, sends
+        it via MQTT and displays its status line once it was sent,
+        so all sensors send at the same time
+        
+        Args:
+            payloads (list): JSON payload (bytes) for each sensor, from encode()
+            lines (list): Status line to display for each sensor once sent
+        """
+        for k, (queue, item) in enumerate(zip(self._queues, zip(payloads, lines))):
+            # Sender still busy with an older reading: replace the one
+            # waiting behind it, so only the newest reading goes out
+            if queue.full():
+                queue.get_nowait()
+                queue.task_done()
+                print(f"✗ Skipped stale reading for {self.locations[k]}")
+            queue.put_nowait(item)
+    
+    async def _consume(self, k):
+        """
+        Send every payload queued for one sensor, in order
+        
+        Only readings that reached IoT Hub are displayed and counted;
+        failed sends are reported by _send instead
+        
+        Args:
+            k (int): Index of the sensor
+        """
+        queue = self._queues[k]
+        while True:
+            payload, line = await queue.get()
+            try:
+                if await self._send(k, payload):
+                    self.messages_sent[k] += 1
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+            finally:
+                queue.task_done()
+    
+    async def drain(self):
+        """
+        Wait until every queued reading has been sent (or has failed)
+        """
+        await asyncio.gather(*[queue.join() for queue in self._queues])
+    
+    async def _send(self, k, payload):
+        """
+        Send one encoded reading to Azure IoT Hub
+        
+        If the send fails because the connection dropped, reconnects and
+        sends the reading once more; it is only dropped if that fails too
+        
+        Args:
+            k (int): Index of the sensor
+            payload (bytes): JSON-encoded reading
         
         Returns:
             bool: True if message sent successfully, False otherwise
         """
         try:
-            # Generate reading
-            reading = self.generate_reading()
-            
-            # Create IoT Hub message
             # Message wraps the JSON payload with metadata
-            message = Message(json.dumps(reading))
-            message.content_encoding = "utf-8"
-            message.content_type = "application/json"
+            self._messages[k].data = payload
             
             # Send to IoT Hub (async operation)
-            await self.client.send_message(message)
-            
-            # Determine safety status for display
-            # This matches the Stream Analytics logic
-            if reading["iceThickness"] >= 30 and reading["surfaceTemp"] <= -2:
-                status = "🟢 SAFE"
-            elif reading["iceThickness"] >= 25 and reading["surfaceTemp"] <= 0:
-                status = "🟡 CAUTION"
-            else:
-                status = "🔴 UNSAFE"
+            await self.clients[k].send_message(self._messages[k])
             
-            # Display formatted output for monitoring
-            print(f"{status} | {self.location:15} | "
-                  f"Ice: {reading['iceThickness']:5.2f}cm | "
-                  f"Surf: {reading['surfaceTemp']:5.2f}°C | "
-                  f"Snow: {reading['snowAccumulation']:5.2f}cm | "
-                  f"Ext: {reading['externalTemp']:5.2f}°C")
+            return True
             
+        except Exception as e:
+            print(f"✗ Send failed for {self.locations[k]}: {e}")
+            if self.clients[k].connected or not await self._reconnect(k):
+                return False
+        
+        # Reconnected - retry the same reading once, so a dropped
+        # connection doesn't lose it
+        try:
+            await self.clients[k].send_message(self._messages[k])
             return True
             
         except Exception as e:
-            print(f"✗ Send failed for {self.location}: {e}")
+            print(f"✗ Retry failed for {self.locations[k]}: {e}")
             return False
     
+    async def _reconnect(self, k):
+        """
+        Re-establish a dropped connection to Azure IoT Hub
+        
+        Retries with exponential backoff, giving up after
+        RECONNECT_ATTEMPTS tries (the next reading will try again)
+        
+        Args:
+            k (int): Index of the sensor
+        
+        Returns:
+            bool: True if reconnected, False otherwise
+        """
+        delay = RECONNECT_BASE_DELAY
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            try:
+                await self.clients[k].connect()
+                print(f"✓ Reconnected: {self.locations[k]}")
+                return True
+            
+            except Exception as e:
+                print(f"✗ Reconnect attempt {attempt} failed for {self.locations[k]}: {e}")
+                if attempt < RECONNECT_ATTEMPTS:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        
+        return False
+    
     async def disconnect(self):
         """
-        Gracefully disconnect from Azure IoT Hub
+        Gracefully disconnect every sensor from Azure IoT Hub
         
-        Closes the connection and cleans up resources
+        Stops the sender tasks, closes the connections and cleans up resources
+        """
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        
+        await asyncio.gather(
+            *[self._disconnect(k) for k in range(len(self.clients))]
+        )
+    
+    async def _disconnect(self, k):
+        """
+        Gracefully disconnect one sensor from Azure IoT Hub
+        
+        Args:
+            k (int): Index of the sensor
         """
-        if self.client:
-            await self.client.disconnect()
-            print(f"✓ Disconnected: {self.location}")
+        if self.clients[k]:
+            await self.clients[k].disconnect()
+            print(f"✓ Disconnected: {self.locations[k]}")
 
 
-async def run_simulator(duration_minutes=30):
+async def run_simulator(sensors, duration_minutes=30, seed=None):
     """
-    Run all three sensor simulators concurrently
+    Run all three sensors concurrently
     
     This is the main orchestration function that:
-    1. Creates 3 sensor instances
+    1. Creates the sensor farm (all 3 sensors)
     2. Connects them to IoT Hub
     3. Sends readings every 10 seconds
     4. Runs for specified duration
     5. Disconnects gracefully
     
     Args:
+        sensors (dict): Sensor configurations keyed by location key (built in main)
         duration_minutes (int): How long to run the simulation (default 30 minutes)
+        seed (int): Optional seed to make the simulated data reproducible
+            (default None: different data on every run)
     """
     print("=" * 90)
     print("RIDEAU CANAL SKATEWAY - IoT SENSOR SIMULATOR")
@@ -240,26 +506,23 @@ async def run_simulator(duration_minutes=30):
     print(f"Total messages: {duration_minutes * 6 * 3}")
     print()
     
-    # Create sensor simulators for all three locations
-    simulators = [
-        SensorSimulator(key, config) 
-        for key, config in SENSORS.items()
-    ]
+    # Create one farm holding all three sensor locations
+    farm = SensorFarm(sensors, seed=seed)
     
     # Connect all sensors to IoT Hub concurrently
-    # asyncio.gather runs multiple async functions at once
     print("Connecting to Azure IoT Hub...")
-    connection_results = await asyncio.gather(
-        *[sim.connect() for sim in simulators]
-    )
+    connected = await farm.connect()
     
     # Check if all sensors connected successfully
-    if not all(connection_results):
+    if not connected:
         print("\n✗ ERROR: Some sensors failed to connect.")
         print("Check your connection strings in the .env file.")
         print("Get connection strings from: Azure Portal > IoT Hub > Devices")
         return
     
+    # Start the per-sensor sender tasks
+    farm.start()
+    
     # Display header for real-time monitoring
     print("\n" + "=" * 90)
     print("STATUS | LOCATION        | ICE THICKNESS | SURFACE TEMP | SNOW ACCUM | EXTERNAL TEMP")
@@ -269,25 +532,60 @@ async def run_simulator(duration_minutes=30):
     # 6 readings per minute (every 10 seconds)
     iterations = duration_minutes * 6
     
+    # Pre-compute the full random walk, so the loop only looks up rows
+    farm.plan(iterations)
+    
+    # Reading i is scheduled at start + i * 10 seconds on the monotonic clock,
+    # so time spent sending doesn't push later readings back
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    
     try:
         # Main simulation loop
         for i in range(iterations):
-            # Send readings from all sensors concurrently
-            # This means all 3 sensors send at the same time
-            await asyncio.gather(
-                *[sim.send_reading() for sim in simulators]
-            )
+            # All sensors report the same timestamp for this round
+            timestamp = _utc_timestamp()
+            
+            # Advance and encode every sensor, then hand the readings
+            # to the sender tasks (no awaits - sends happen concurrently)
+            states = farm.tick(i)
+            payloads = farm.encode(states, timestamp)
+            
+            # Classify all sensors in one vector operation
+            # Uses the rounded values, i.e. exactly what was sent
+            ice, surf = states[:, :2].T
+            status_code = (((ice >= 30) << 3) | ((ice >= 25) << 2)
+                           | ((surf <= -2) << 1) | (surf <= 0))
+            statuses = STATUS_TABLE[status_code]
+            
+            # Format output for monitoring
+            # Each line is displayed by the sender task once its reading is sent
+            lines = []
+            for location, row, status in zip(farm.locations, states.tolist(), statuses):
+                ice_thickness, surface_temp, snow_accumulation, external_temp = row
+                lines.append(f"{status} | {location:15} | "
+                             f"Ice: {ice_thickness:5.2f}cm | "
+                             f"Surf: {surface_temp:5.2f}°C | "
+                             f"Snow: {snow_accumulation:5.2f}cm | "
+                             f"Ext: {external_temp:5.2f}°C\n")
+            farm.send_all(payloads, lines)
             
-            # Wait 10 seconds before next reading
+            # Wait until the next reading is due (10 seconds after this one started)
             if i < iterations - 1:  # Don't wait after last iteration
-                await asyncio.sleep(10)
+                next_deadline = start + (i + 1) * 10
+                await asyncio.sleep(max(0.0, next_deadline - loop.time()))
+        
+        # Let the last readings finish sending
+        await farm.drain()
         
         # Simulation complete
         print("\n" + "=" * 90)
         print(f"✓ SIMULATION COMPLETE!")
-        print(f"  Total messages sent: {iterations * 3}")
+        print(f"  Total messages sent: {sum(farm.messages_sent)}")
         print(f"  Duration: {duration_minutes} minutes")
-        print(f"  Messages per location: {iterations}")
+        print("  Messages sent per location:")
+        for location, count in zip(farm.locations, farm.messages_sent):
+            print(f"    {location:15} {count} of {iterations}")
         print("=" * 90)
         
     except KeyboardInterrupt:
@@ -297,29 +595,37 @@ async def run_simulator(duration_minutes=30):
     finally:
         # Always disconnect sensors gracefully, even if error occurred
         print("\nDisconnecting sensors...")
-        await asyncio.gather(
-            *[sim.disconnect() for sim in simulators]
-        )
+        await farm.disconnect()
 
 
 def main():
     """
     Main entry point for the simulator
     
-    Checks environment variables and starts the async simulation
+    Loads the .env file, builds the sensor configuration, checks
+    environment variables and starts the async simulation
     """
     
     print("\nRideau Canal Skateway - Sensor Simulator")
     print("=========================================\n")
     
-    # Check if all required connection strings are set
+    # Load environment variables from .env file
+    # This keeps secrets out of code!
+    load_dotenv()
+    
+    # Build the sensor configuration and check that every
+    # required connection string is set, in a single pass
+    sensors = {}
     missing_vars = []
-    for sensor_key, config in SENSORS.items():
-        if not config["connection_string"]:
-            # Convert sensor key to environment variable name
-            # Example: 'dows-lake' → 'DOWS_LAKE_CONNECTION_STRING'
-            env_var = f"{sensor_key.upper().replace('-', '_')}_CONNECTION_STRING"
+    for sensor_key, env_var, location in SENSOR_SPECS:
+        connection_string = os.getenv(env_var)
+        if not connection_string:
             missing_vars.append(env_var)
+        sensors[sensor_key] = {
+            "device_id": f"{sensor_key}-sensor",
+            "connection_string": connection_string,
+            "location": location
+        }
     
     if missing_vars:
         print("✗ ERROR: Missing environment variables!")
@@ -333,11 +639,19 @@ def main():
         print("4. Click on each device and copy 'Primary Connection String'")
         return
     
+    # Use the libuv-based uvloop event loop when it's installed
+    # (uvloop doesn't support Windows, where the default loop is used)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     # Run the simulator
     try:
         print("Starting simulator...\n")
         # asyncio.run() starts the async event loop
-        asyncio.run(run_simulator(duration_minutes=30))
+        asyncio.run(run_simulator(sensors, duration_minutes=30))
         
     except Exception as e:
         print(f"\n✗ Simulator error: {e}")